@@ -1,50 +1,74 @@
 import os
 import sys
+import time
+import array
+import asyncio
 import logging
+import threading
 from pathlib import Path
-from typing import List, Optional
+from types import MappingProxyType
+from typing import TYPE_CHECKING, List, Optional
 from datetime import datetime
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 import tempfile
-from dotenv import load_dotenv
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, field_validator
 
 # Ensure project root is on sys.path when running with uvicorn --reload
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-# Load environment variables from backend/.env if present
-load_dotenv(PROJECT_ROOT / "backend" / ".env", override=False)
+# Load environment variables from backend/.env if present. Vercel injects them
+# directly, so skip importing python-dotenv there.
+if not os.getenv("VERCEL"):
+    from dotenv import load_dotenv
 
-from rag.chain import RAGChain
+    load_dotenv(PROJECT_ROOT / "backend" / ".env", override=False)
 
-# Configure logging
+if TYPE_CHECKING:
+    from rag.chain import RAGChain
+
+# Configure logging (stdout only; serverless filesystems are read-only)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[logging.StreamHandler()]
 )
 logger = logging.getLogger(__name__)
 
+# Only the most recent turns are sent to the model
+MAX_HISTORY_TURNS = 3
+MAX_HISTORY_CONTENT_LENGTH = 4000
+
 # Pydantic models for validation
 class ChatRequest(BaseModel):
+    # Stripping happens in pydantic-core, so a blank message fails min_length
+    model_config = {"str_strip_whitespace": True}
+    
     message: str = Field(..., min_length=1, max_length=2000, description="User message")
     history: Optional[List[dict]] = Field(default=None, description="Chat history")
     top_k: int = Field(default=5, ge=1, le=20, description="Number of documents to retrieve")
     namespace: Optional[str] = Field(default="default", max_length=100, description="Document namespace")
     
-    @validator('message')
-    def validate_message(cls, v):
-        if not v.strip():
-            raise ValueError('Message cannot be empty')
-        return v.strip()
+    @field_validator('history', mode='before')
+    @classmethod
+    def validate_history(cls, v):
+        # Truncate before item validation so long transcripts aren't parsed in full
+        if not isinstance(v, list):
+            return v
+        v = v[-MAX_HISTORY_TURNS:]
+        # Long turns (usually the assistant's own earlier answers) are cut down
+        # to cap prompt tokens rather than failing the user's next message
+        truncated = []
+        for turn in v:
+            content = turn.get("content") if isinstance(turn, dict) else None
+            if isinstance(content, str) and len(content) > MAX_HISTORY_CONTENT_LENGTH:
+                turn = {**turn, "content": content[:MAX_HISTORY_CONTENT_LENGTH]}
+            truncated.append(turn)
+        return truncated
 
 class HealthResponse(BaseModel):
     status: str
@@ -54,37 +78,55 @@ class HealthResponse(BaseModel):
 
 # Configuration
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE_MB", "10")) * 1024 * 1024  # 10MB default
+UPLOAD_CHUNK_SIZE = 64 * 1024
+PINECONE_INDEX = os.getenv("PINECONE_INDEX", "documents")
 ALLOWED_EXTENSIONS = {'.pdf', '.txt', '.md'}
 
+# Static response for plain OPTIONS requests. Real CORS preflights are answered
+# by CORSMiddleware, which also decides the allowed origin, so none is set here
+_PREFLIGHT_BODY = b"OK"
+_PREFLIGHT_HEADERS = MappingProxyType({
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "*",
+})
+
 def _get_allowed_origins() -> List[str]:
     raw = os.getenv("ALLOWED_ORIGINS", "")
     if not raw:
         # Default origins for development
-        return ["http://localhost:5173", "http://localhost:5174", "http://localhost:3000", "*"]
+        return ["http://localhost:5173", "http://localhost:5174", "http://localhost:3000"]
     return [origin.strip() for origin in raw.split(",") if origin.strip()]
 
-# Rate limiting (simple in-memory)
-request_counts = {}
+# Opt-in pattern for origins that can't be listed up front, e.g. preview
+# deployments that get a new subdomain per build
+ALLOWED_ORIGIN_REGEX = os.getenv("ALLOWED_ORIGIN_REGEX") or None
+
+# Rate limiting (simple in-memory, fixed window per client slot)
 RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))  # requests per minute
 RATE_LIMIT_WINDOW = 60  # seconds
+# Clients are hashed into a fixed number of slots so memory stays bounded
+_RL_SLOTS = 1 << 14
+_RL_WINDOW_NS = RATE_LIMIT_WINDOW * 1_000_000_000
+_rl_window = array.array('Q', [0]) * _RL_SLOTS
+_rl_count = array.array('I', [0]) * _RL_SLOTS
+
+_RATE_LIMITED_BODY = b'{"error":"Rate limit exceeded. Please try again later."}'
 
 def check_rate_limit(client_ip: str) -> bool:
-    now = datetime.now()
-    minute_key = f"{client_ip}:{now.minute}"
-    
-    if minute_key not in request_counts:
-        request_counts[minute_key] = 0
-    
-    if request_counts[minute_key] >= RATE_LIMIT_REQUESTS:
+    slot = hash(client_ip) & (_RL_SLOTS - 1)
+    window = time.monotonic_ns() // _RL_WINDOW_NS
+    if _rl_window[slot] != window:
+        _rl_window[slot] = window
+        _rl_count[slot] = 0
+    if _rl_count[slot] >= RATE_LIMIT_REQUESTS:
         return False
-    
-    request_counts[minute_key] += 1
+    _rl_count[slot] += 1
     return True
 
 app = FastAPI(
     title="AI Document Search (RAG Chatbot)",
     description="Production-ready RAG chatbot with document upload and semantic search",
-    version="1.0.0"
+    version="1.0.0",
 )
 
 @app.on_event("startup")
@@ -103,13 +145,18 @@ async def _check_required_env() -> None:
             + ", ".join(missing)
             + ". Create backend/.env (copy backend/env.example) and set real values."
         )
+    # Build the chain (clients, index handle) off the event loop so the first
+    # request doesn't pay for it
+    app.state.prewarm = asyncio.create_task(_prewarm_chain())
     logger.info("Application startup completed successfully")
 
 # Middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=_get_allowed_origins(),
-    allow_credentials=True,
+    allow_origin_regex=ALLOWED_ORIGIN_REGEX,
+    # The frontend sends no cookies or auth headers
+    allow_credentials=False,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
 )
@@ -119,10 +166,7 @@ async def rate_limit_middleware(request: Request, call_next):
     client_ip = request.client.host
     if not check_rate_limit(client_ip):
         logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-        return JSONResponse(
-            status_code=429,
-            content={"error": "Rate limit exceeded. Please try again later."}
-        )
+        return Response(content=_RATE_LIMITED_BODY, status_code=429, media_type="application/json")
     
     response = await call_next(request)
     return response
@@ -170,27 +214,33 @@ async def detailed_health():
             }
         )
 
-_rag_chain: Optional[RAGChain] = None
+_rag_chain: Optional["RAGChain"] = None
+_rag_chain_lock = threading.Lock()
 
-def _get_chain() -> RAGChain:
+def _get_chain() -> "RAGChain":
     global _rag_chain
     if _rag_chain is None:
-        _rag_chain = RAGChain()
+        with _rag_chain_lock:
+            if _rag_chain is None:
+                # Imported here so openai/pinecone aren't loaded until a chain is needed
+                from rag.chain import RAGChain
+
+                _rag_chain = RAGChain()
     return _rag_chain
 
+async def _prewarm_chain() -> None:
+    try:
+        chain = await asyncio.to_thread(_get_chain)
+        if os.getenv("PREWARM", "1") == "1":
+            await chain.vectorstore.warmup()
+        logger.info("RAG chain prewarmed")
+    except Exception as e:
+        logger.warning(f"RAG chain prewarm failed: {e}")
+
 @app.options("/chat")
 @app.options("/api/chat")
 async def chat_options():
-    from fastapi.responses import Response
-    return Response(
-        content="OK",
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-        }
-    )
+    return Response(content=_PREFLIGHT_BODY, status_code=200, headers=_PREFLIGHT_HEADERS)
 
 @app.post("/chat")
 @app.post("/api/chat")
@@ -200,7 +250,7 @@ async def chat(request: ChatRequest) -> dict:
         logger.info(f"Chat request received: {len(request.message)} chars, top_k={request.top_k}")
         
         chain = _get_chain()
-        result = chain.invoke(
+        result = await chain.invoke(
             message=request.message,
             history=request.history,
             top_k=request.top_k,
@@ -217,16 +267,7 @@ async def chat(request: ChatRequest) -> dict:
 @app.options("/upload")
 @app.options("/api/upload")
 async def upload_options():
-    from fastapi.responses import Response
-    return Response(
-        content="OK",
-        status_code=200,
-        headers={
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-        }
-    )
+    return Response(content=_PREFLIGHT_BODY, status_code=200, headers=_PREFLIGHT_HEADERS)
 
 @app.post("/upload")
 @app.post("/api/upload")
@@ -249,75 +290,86 @@ async def upload_document(
             detail=f"File type {file_ext} not supported. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
-    # Check file size
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=413, 
-            detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024 * 1024)}MB"
-        )
-    
     # Validate namespace
     if not namespace or len(namespace.strip()) == 0:
         namespace = "default"
     namespace = namespace.strip()
     
-    logger.info(f"Processing upload: {file.filename} ({len(content)} bytes) to namespace '{namespace}'")
-    
+    # Stream the upload to a temp file, rejecting it as soon as it exceeds the size limit
+    file_size = 0
+    tmp_file_path: Optional[str] = None
     try:
-        # Save uploaded file temporarily
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-            tmp_file.write(content)
             tmp_file_path = tmp_file.name
-        
-        # Process the file using the ingestion logic
-        from scripts.ingest import file_to_text, chunk_text, build_items, upsert_items
-        
-        # Extract text
-        text = file_to_text(Path(tmp_file_path))
-        if not text.strip():
-            raise HTTPException(status_code=400, detail="No text content found in file")
-        
-        # Chunk text
-        chunks = chunk_text(text)
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No content chunks created")
-        
-        # Build items for upsert
-        items = build_items(Path(file.filename), chunks)
-        
-        # Upsert to Pinecone
-        upsert_items(
-            index_name=os.getenv("PINECONE_INDEX", "documents"),
-            namespace=namespace,
-            items=items
-        )
-        
-        # Clean up temp file
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    break
+                await asyncio.to_thread(tmp_file.write, chunk)
+    except BaseException as e:
+        # Don't leave a partial upload behind (client disconnect, disk full, ...)
+        if tmp_file_path:
+            try:
+                os.unlink(tmp_file_path)
+            except OSError:
+                pass
+        if not isinstance(e, Exception):
+            raise
+        logger.error(f"Upload error for {file.filename}: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
+    if file_size > MAX_FILE_SIZE:
         os.unlink(tmp_file_path)
+        raise HTTPException(
+            status_code=413, 
+            detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024 * 1024)}MB"
+        )
+    
+    logger.info(f"Processing upload: {file.filename} ({file_size} bytes) to namespace '{namespace}'")
+    
+    try:
+        # Extraction, embedding and upsert are blocking; keep them off the event loop
+        chunks_created = await asyncio.to_thread(_process_upload, Path(tmp_file_path), file.filename, namespace)
         
-        logger.info(f"Successfully processed {file.filename}: {len(chunks)} chunks created")
+        logger.info(f"Successfully processed {file.filename}: {chunks_created} chunks created")
         
         return {
             "success": True,
             "message": f"Successfully processed {file.filename}",
-            "chunks_created": len(chunks),
+            "chunks_created": chunks_created,
             "namespace": namespace,
-            "file_size_bytes": len(content)
+            "file_size_bytes": file_size
         }
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Upload error for {file.filename}: {e}")
-        # Clean up temp file if it exists
-        if 'tmp_file_path' in locals():
-            try:
-                os.unlink(tmp_file_path)
-            except:
-                pass
         raise HTTPException(status_code=500, detail=f"Failed to process file: {str(e)}")
 
+def _process_upload(tmp_file_path: Path, filename: str, namespace: str) -> int:
+    """Ingest an uploaded temp file and delete it afterwards. Returns the number of chunks."""
+    try:
+        # Process the file using the ingestion logic
+        from scripts.ingest import iter_items, upsert_items
+        
+        # Chunks stream from the parser straight into embedding and upsert.
+        # Parse in this thread: forking PDF workers from the multi-threaded
+        # server can deadlock, and concurrent uploads would multiply them
+        chunks_created = upsert_items(
+            index_name=PINECONE_INDEX,
+            namespace=namespace,
+            items=iter_items(tmp_file_path, source=Path(filename), workers=1)
+        )
+        if not chunks_created:
+            raise HTTPException(status_code=400, detail="No text content found in file")
+        return chunks_created
+    finally:
+        # Clean up temp file
+        try:
+            os.unlink(tmp_file_path)
+        except OSError:
+            pass
+
 # Error handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
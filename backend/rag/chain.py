@@ -1,10 +1,12 @@
+import asyncio
 import os
+import re
 from typing import Any, Dict, List, Optional
 
-from openai import OpenAI
+from rag.vectorstore import PineconeVectorStore, get_openai_client
 
-from rag.vectorstore import PineconeVectorStore
 
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
 
 SYSTEM_PROMPT = (
     "You are a helpful AI assistant that can answer questions about uploaded documents and engage in general conversation. "
@@ -13,6 +15,18 @@ SYSTEM_PROMPT = (
     "Always be friendly, helpful, and conversational. If you reference information from the provided documents, "
     "mention that it's from the uploaded content."
 )
+# Shared by every request; the OpenAI client only reads it
+_SYSTEM_MESSAGE: Dict[str, str] = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+# Common greetings and general conversation starters
+_GREETINGS = frozenset({
+    "hi", "hello", "hey", "good morning", "good afternoon", "good evening",
+    "how are you", "how's it going", "what's up", "how do you do",
+    "thanks", "thank you", "bye", "goodbye", "see you later",
+    "nice to meet you", "pleasure to meet you",
+})
+_GREETING_RE = re.compile(r"^(?:hi|hello|hey|ok|yes|no)\b")
 
 
 class RAGChain:
@@ -21,77 +35,68 @@ class RAGChain:
         openai_api_key = os.getenv("OPENAI_API_KEY")
         if not openai_api_key:
             raise RuntimeError("OPENAI_API_KEY is not set")
-        self.client = OpenAI()
-        self.chat_model = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+        self.client = get_openai_client()
+        self.chat_model = CHAT_MODEL
 
     def _build_context(self, docs: List[Dict[str, Any]]) -> str:
-        lines: List[str] = []
-        for d in docs:
-            meta = d.get("metadata", {})
-            source = meta.get("source", "unknown")
-            snippet = meta.get("text") or meta.get("content") or ""
-            header = f"Source: {source}"
-            lines.append(header)
-            lines.append(snippet)
-            lines.append("")
-        return "\n".join(lines)
+        return "\n\n".join(self._format_doc(d.get("metadata", {})) for d in docs)
+
+    @staticmethod
+    def _format_doc(meta: Dict[str, Any]) -> str:
+        snippet = meta.get("text") or meta.get("content") or ""
+        return f"Source: {meta.get('source', 'unknown')}\n{snippet}"
 
     def _is_general_conversation(self, message: str) -> bool:
         """Check if the message is a general greeting or conversation starter that shouldn't use document context."""
-        message_lower = message.lower().strip()
-        
-        # Common greetings and general conversation starters
-        greetings = [
-            "hi", "hello", "hey", "good morning", "good afternoon", "good evening",
-            "how are you", "how's it going", "what's up", "how do you do",
-            "thanks", "thank you", "bye", "goodbye", "see you later",
-            "nice to meet you", "pleasure to meet you"
-        ]
-        
-        # Check if the message is a greeting or very short general statement
-        if message_lower in greetings:
-            return True
-            
-        # Check if it's a very short message (likely conversational)
-        if len(message.split()) <= 2 and any(word in message_lower for word in ["hi", "hello", "hey", "ok", "yes", "no"]):
+        message_lower = message.strip().lower()
+        if message_lower in _GREETINGS:
             return True
-            
-        return False
+        # Very short messages starting with a conversational word
+        return message_lower.count(" ") <= 1 and _GREETING_RE.match(message_lower) is not None
 
-    def invoke(self, message: str, history: Optional[List[Dict[str, str]]] = None, top_k: int = 5, namespace: Optional[str] = None) -> Dict[str, Any]:
+    async def invoke(self, message: str, history: Optional[List[Dict[str, str]]] = None, top_k: int = 5, namespace: Optional[str] = None) -> Dict[str, Any]:
         history = history or []
         
         # Check if this is general conversation that shouldn't use document context
         is_general_conversation = self._is_general_conversation(message)
-        
-        if is_general_conversation:
+
+        # Start retrieval right away so the embedding and Pinecone round-trips
+        # overlap with assembling the rest of the prompt
+        retrieval: Optional[asyncio.Task] = None
+        if not is_general_conversation:
+            retrieval = asyncio.create_task(self.vectorstore.query(message, top_k=top_k, namespace=namespace))
+
+        # Prior turns go between the system prompt and the new question;
+        # callers are expected to have truncated the history already
+        history_messages: List[Dict[str, str]] = []
+        for turn in history:
+            role = turn.get("role", "user")
+            content = turn.get("content", "")
+            history_messages.append({"role": role, "content": content})
+
+        if retrieval is None:
             # For general conversation, don't retrieve documents
             retrieved = []
-            context_text = ""
             user_content = message
         else:
-            # For document-related queries, retrieve and use context
-            retrieved = self.vectorstore.query(message, top_k=top_k, namespace=namespace)
-            context_text = self._build_context(retrieved)
+            # For document-related queries, use the retrieved context
+            retrieved = await retrieval
             
             # Only use context if we found relevant documents with good scores
-            relevant_docs = [doc for doc in retrieved if doc.get("score", 0) > 0.3]
-            if relevant_docs and context_text.strip():
+            has_relevant = any(doc.get("score", 0) > 0.3 for doc in retrieved)
+            context_text = self._build_context(retrieved) if has_relevant else ""
+            if context_text.strip():
                 user_content = f"Here's some relevant information from uploaded documents:\n\n{context_text}\n\nNow, please answer this question: {message}"
             else:
                 user_content = f"Question: {message}\n\n(Note: No relevant document context was found for this query, so please answer using your general knowledge.)"
 
         messages: List[Dict[str, str]] = [
-            {"role": "system", "content": SYSTEM_PROMPT},
+            _SYSTEM_MESSAGE,
+            *history_messages,
             {"role": "user", "content": user_content},
         ]
-        # Optional: include last 3 turns of history (truncated)
-        for turn in history[-3:]:
-            role = turn.get("role", "user")
-            content = turn.get("content", "")
-            messages.append({"role": role, "content": content})
 
-        completion = self.client.chat.completions.create(
+        completion = await self.client.chat.completions.create(
             model=self.chat_model,
             messages=messages,
             temperature=0.2,
@@ -1,66 +1,272 @@
+import asyncio
+import hashlib
 import os
-from typing import Any, Dict, List, Optional, Tuple
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
 
-from openai import OpenAI
+import httpx
+from openai import NOT_GIVEN, AsyncOpenAI
 from pinecone import Pinecone, ServerlessSpec
 
 
+PINECONE_INDEX = os.getenv("PINECONE_INDEX", "documents")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Shortened embeddings (e.g. EMBED_DIM=512) need an index created with the same dimension
+EMBED_DIM = int(os.environ["EMBED_DIM"]) if os.getenv("EMBED_DIM") else None
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_TTL = 3600  # seconds, Redis only
+EMBEDDING_BATCH_WAIT = int(os.getenv("EMBEDDING_BATCH_WAIT_MS", "8")) / 1000
+EMBEDDING_BATCH_MAX = int(os.getenv("EMBEDDING_BATCH_MAX", "64"))
+# Decimal places kept when sending vectors to Pinecone; see compact_vector()
+VECTOR_DECIMALS = 6
+
+
+def compact_vector(values: Iterable[float]) -> List[float]:
+    """Round vector components for the wire.
+
+    Pinecone's REST API sends vectors as JSON text, and a float32 component
+    widened to a Python float prints with up to 17 significant digits. Six
+    decimal places halves the payload and leaves cosine scores unchanged in
+    practice.
+    """
+    return [round(v, VECTOR_DECIMALS) for v in values]
+
+
+class EmbeddingCache:
+    """LRU cache of query embeddings, optionally shared across workers via Redis.
+
+    Vectors are kept as float32 arrays, which is half the size of a list of
+    Python floats and serializes straight to bytes for Redis.
+    """
+
+    def __init__(self, maxsize: int = EMBEDDING_CACHE_SIZE, redis_url: Optional[str] = None) -> None:
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, array]" = OrderedDict()
+        self._redis = None
+        if redis_url:
+            import redis.asyncio as redis
+
+            self._redis = redis.Redis.from_url(redis_url)
+
+    @staticmethod
+    def key(model: str, dimensions: Optional[int], text: str) -> str:
+        return f"emb:{model}:{dimensions or 'full'}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    async def get(self, key: str) -> Optional[array]:
+        vec = self._entries.get(key)
+        if vec is not None:
+            self._entries.move_to_end(key)
+            return vec
+        if self._redis is None:
+            return None
+        try:
+            raw = await self._redis.get(key)
+        except Exception:
+            # The cache is best effort; fall back to embedding the query
+            return None
+        if not raw:
+            return None
+        vec = array("f")
+        vec.frombytes(raw)
+        self._remember(key, vec)
+        return vec
+
+    async def set(self, key: str, vec: array) -> None:
+        self._remember(key, vec)
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, vec.tobytes(), ex=EMBEDDING_CACHE_TTL)
+            except Exception:
+                pass
+
+    def _remember(self, key: str, vec: array) -> None:
+        self._entries[key] = vec
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into one API call.
+
+    Texts submitted within ``max_wait`` seconds of each other (up to
+    ``max_batch``) are sent as a single ``embeddings.create`` request and the
+    vectors are handed back to the waiting coroutines.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        model: str,
+        dimensions: Optional[int] = None,
+        max_wait: float = EMBEDDING_BATCH_WAIT,
+        max_batch: int = EMBEDDING_BATCH_MAX,
+    ) -> None:
+        self.client = client
+        self.model = model
+        self.dimensions = dimensions
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self._queue: Optional["asyncio.Queue[Tuple[str, asyncio.Future]]"] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def submit(self, text: str) -> List[float]:
+        if self._worker is None or self._worker.done() or self._worker.get_loop() is not asyncio.get_running_loop():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _drain(self) -> List[Tuple[str, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    async def _run(self) -> None:
+        while True:
+            items = await self._drain()
+            # Don't wait for the API here so the next batch can start collecting
+            task = asyncio.create_task(self._flush(items))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _flush(self, items: List[Tuple[str, asyncio.Future]]) -> None:
+        try:
+            response = await self.client.embeddings.create(
+                model=self.model,
+                input=[text for text, _ in items],
+                dimensions=self.dimensions or NOT_GIVEN,
+            )
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), d in zip(items, response.data):
+            if not future.done():
+                future.set_result(d.embedding)
+
+
+# Clients are shared process-wide so connection pools and TLS sessions survive
+# across requests instead of being rebuilt with every chain.
+@lru_cache(maxsize=None)
+def get_openai_client() -> AsyncOpenAI:
+    # HTTP/2 lets concurrent embedding and chat calls share one TLS connection.
+    # Fail fast on connect so a cold path doesn't hang for the default timeout.
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=httpx.Timeout(30.0, connect=2.0),
+        trust_env=False,
+    )
+    return AsyncOpenAI(http_client=http_client)
+
+
+@lru_cache(maxsize=None)
+def get_pinecone_client() -> Pinecone:
+    return Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+
+
+@lru_cache(maxsize=None)
+def get_pinecone_index(index_name: str) -> Any:
+    return get_pinecone_client().Index(index_name)
+
+
+def ensure_index(pc: Pinecone, index_name: str, region: str, dimension: Optional[int] = None) -> None:
+    """Create the index if it doesn't exist yet."""
+    if index_name in [idx["name"] for idx in pc.list_indexes()]:
+        return
+    # Default to OpenAI text-embedding-3-small dimension 1536
+    pc.create_index(
+        name=index_name,
+        dimension=dimension or 1536,
+        metric="cosine",
+        spec=ServerlessSpec(
+            cloud="aws",
+            region=region
+        )
+    )
+
+
 class PineconeVectorStore:
     def __init__(self) -> None:
         pinecone_api_key = os.getenv("PINECONE_API_KEY")
         pinecone_env = os.getenv("PINECONE_ENV")
-        index_name = os.getenv("PINECONE_INDEX", "documents")
         if not pinecone_api_key:
             raise RuntimeError("PINECONE_API_KEY is not set")
         if not pinecone_env:
             raise RuntimeError("PINECONE_ENV is not set")
 
-        self.index_name = index_name
-        self.pc = Pinecone(api_key=pinecone_api_key)
-
-        # Ensure index exists (safe on serverless init flows outside hot path)
-        try:
-            self.index = self.pc.Index(index_name)
-        except Exception:
-            # Create index if it doesn't exist
-            # Default to OpenAI text-embedding-3-small dimension 1536
-            self.pc.create_index(
-                name=index_name,
-                dimension=1536,
-                metric="cosine",
-                spec=ServerlessSpec(
-                    cloud="aws",
-                    region=pinecone_env
-                )
-            )
-            self.index = self.pc.Index(index_name)
         openai_api_key = os.getenv("OPENAI_API_KEY")
         if not openai_api_key:
             raise RuntimeError("OPENAI_API_KEY is not set")
-        self.openai = OpenAI()
-        self.embedding_model = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
 
-    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        self.index_name = PINECONE_INDEX
+        self.embedding_model = EMBEDDING_MODEL
+        self.embedding_dimensions = EMBED_DIM
+        self.pc = get_pinecone_client()
+        # Checking for (and creating) the index costs a control-plane round-trip,
+        # so only do it when asked to, e.g. from the ingest script
+        if os.getenv("ENSURE_INDEX") == "1":
+            ensure_index(self.pc, self.index_name, pinecone_env, self.embedding_dimensions)
+        self.index = get_pinecone_index(self.index_name)
+        self.openai = get_openai_client()
+        self.embedding_cache = EmbeddingCache(redis_url=os.getenv("REDIS_URL"))
+        self.batcher = EmbeddingBatcher(self.openai, self.embedding_model, self.embedding_dimensions)
+
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
         if not texts:
             return []
-        response = self.openai.embeddings.create(
+        response = await self.openai.embeddings.create(
             model=self.embedding_model,
             input=texts,
+            dimensions=self.embedding_dimensions or NOT_GIVEN,
         )
         return [d.embedding for d in response.data]
 
-    def upsert(self, items: List[Tuple[str, str, Dict[str, Any]]], namespace: Optional[str] = None) -> None:
+    async def warmup(self) -> None:
+        """Open the OpenAI and Pinecone connections ahead of the first real query."""
+        await asyncio.gather(
+            self.embed_texts(["warmup"]),
+            asyncio.to_thread(self.index.describe_index_stats),
+        )
+
+    async def _embed_one(self, text: str) -> array:
+        """Embed a single query, reusing a cached vector when the same text was seen before."""
+        key = EmbeddingCache.key(self.embedding_model, self.embedding_dimensions, text)
+        vec = await self.embedding_cache.get(key)
+        if vec is None:
+            vec = array("f", await self.batcher.submit(text))
+            await self.embedding_cache.set(key, vec)
+        return vec
+
+    async def upsert(self, items: List[Tuple[str, str, Dict[str, Any]]], namespace: Optional[str] = None) -> None:
         # items: (id, text, metadata)
         vectors: List[Dict[str, Any]] = []
-        embeddings = self.embed_texts([text for _, text, _ in items])
-        for (item_id, _text, metadata), values in zip(items, embeddings):
-            vectors.append({"id": item_id, "values": values, "metadata": metadata})
-        self.index.upsert(vectors=vectors, namespace=namespace or "default")
-
-    def query(self, query: str, top_k: int = 5, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
-        query_vec = self.embed_texts([query])[0]
-        result = self.index.query(
-            vector=query_vec,
+        embeddings = await self.embed_texts([text for _, text, _ in items])
+        for (item_id, text, metadata), values in zip(items, embeddings):
+            vectors.append({"id": item_id, "values": compact_vector(values), "metadata": {**metadata, "text": text}})
+        await asyncio.to_thread(self.index.upsert, vectors=vectors, namespace=namespace or "default")
+
+    async def query(self, query: str, top_k: int = 5, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+        query_vec = await self._embed_one(query)
+        # The Pinecone client is synchronous; keep it off the event loop
+        result = await asyncio.to_thread(
+            self.index.query,
+            vector=compact_vector(query_vec),
             top_k=top_k,
             include_metadata=True,
             namespace=namespace or "default",
@@ -1,124 +1,688 @@
 import argparse
 import hashlib
+import itertools
+import mmap
 import os
 import pathlib
-from typing import Dict, List, Tuple
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
 
+import tiktoken
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from openai import OpenAI
+from openai import NOT_GIVEN, APIConnectionError, InternalServerError, OpenAI, RateLimitError
 from pinecone import Pinecone, ServerlessSpec
-from pypdf import PdfReader
+from pinecone.exceptions import PineconeApiException
+try:
+    from pinecone import PineconeConnectionError
+except ImportError:
+    # Older SDKs surface dropped connections as urllib3 errors
+    from urllib3.exceptions import ProtocolError as PineconeConnectionError
+import pypdfium2 as pdfium
+from tenacity import RetryCallState, retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from dotenv import load_dotenv
 
 # Load environment variables from backend/.env if present (for standalone runs)
 PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[1]
 load_dotenv(PROJECT_ROOT / "backend" / ".env", override=False)
 
+PINECONE_INDEX = os.getenv("PINECONE_INDEX", "documents")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBED_DIM = int(os.environ["EMBED_DIM"]) if os.getenv("EMBED_DIM") else None
+# Concurrent embedding requests; sized for OpenAI's tier-1 request rate
+MAX_EMBED_CONCURRENCY = 35
+# OpenAI accepts up to 2048 inputs and 300k tokens per embeddings request
+MAX_BATCH_ITEMS = 2048
+MAX_BATCH_TOKENS = 250_000
+# Tokens embedded or waiting for upsert at once. At ~300 tokens and ~50KB of
+# vector per chunk this keeps results in memory under ~100MB whatever the
+# concurrency, since full-size batches would otherwise allow 35 x 250k tokens
+MAX_INFLIGHT_TOKENS = 500_000
+# Pinecone caps upsert requests at 2MB, roughly 100 vectors of 1536 dims with metadata
+UPSERT_BATCH_SIZE = 100
+# OpenAI embedding limits per usage tier as (requests, tokens) per minute
+RATE_LIMIT_TIERS = {
+    "free": (100, 40_000),
+    "tier1": (3_000, 1_000_000),
+    "tier2": (5_000, 1_000_000),
+    "tier3": (5_000, 5_000_000),
+    "tier4": (10_000, 5_000_000),
+    "tier5": (10_000, 10_000_000),
+}
+# Tier to throttle to unless told otherwise; the conservative default keeps
+# the API upload path and plain CLI runs from bursting into 429s
+OPENAI_TIER = os.getenv("OPENAI_TIER", "tier1")
+# Concurrent upsert requests; kept modest to stay clear of Pinecone rate limits
+UPSERT_POOL_THREADS = 8
+# IDs per fetch request when checking for already-ingested chunks (IDs go in the URL)
+FETCH_BATCH_SIZE = 100
+# Decimal places kept when sending vectors to Pinecone, as in rag.vectorstore
+VECTOR_DECIMALS = 6
+# File types main() picks up when walking a directory
+SUPPORTED_SUFFIXES = frozenset({"pdf", "txt", "md"})
+# Processes used to extract text from one PDF; short PDFs aren't worth the startup cost
+PDF_WORKERS = min(os.cpu_count() or 1, 8)
+PDF_SERIAL_MAX_PAGES = 4
+# Digests of files already ingested, so re-runs can skip parsing unchanged files
+INGEST_CACHE = pathlib.Path.home() / ".cache" / "rag-ingest.sqlite"
+# Attempts per OpenAI/Pinecone call before a transient error aborts the ingest
+MAX_ATTEMPTS = 5
+# Longest wait between attempts, whatever a Retry-After header asks for
+MAX_RETRY_WAIT = 60
 
-def file_to_text(path: pathlib.Path) -> str:
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _page_text(pdf: pdfium.PdfDocument, i: int) -> str:
+    page = pdf[i]
+    textpage = page.get_textpage()
+    try:
+        # PDFium ends lines with \r\n
+        return textpage.get_text_range().replace("\r\n", "\n")
+    finally:
+        textpage.close()
+        page.close()
+
+
+def _extract_pages(path: str, start: int, stop: int) -> List[str]:
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return [_page_text(pdf, i) for i in range(start, stop)]
+    finally:
+        pdf.close()
+
+
+def _pdf_to_text(path: pathlib.Path, workers: int) -> str:
+    pdf = pdfium.PdfDocument(str(path))
+    try:
+        num_pages = len(pdf)
+        if workers <= 1 or num_pages <= PDF_SERIAL_MAX_PAGES:
+            return "\n".join(_page_text(pdf, i) for i in range(num_pages))
+    finally:
+        pdf.close()
+
+    # PDFium isn't thread-safe, so split the pages into one contiguous
+    # range per worker process, each opening its own document
+    step = -(-num_pages // workers)
+    starts = range(0, num_pages, step)
+    stops = [min(start + step, num_pages) for start in starts]
+    with ProcessPoolExecutor(max_workers=len(starts)) as executor:
+        parts = executor.map(_extract_pages, itertools.repeat(str(path)), starts, stops)
+        return "\n".join(itertools.chain.from_iterable(parts))
+
+
+def _read_text(path: pathlib.Path) -> str:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap can't map an empty file
+            return ""
+        # Decode straight from the mapping rather than reading into bytes first
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, "utf-8", "ignore")
+    # Match read_text()'s universal newlines so chunk IDs don't change
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def file_to_text(path: pathlib.Path, workers: int = PDF_WORKERS) -> str:
     if path.suffix.lower() == ".pdf":
-        reader = PdfReader(str(path))
-        parts: List[str] = []
-        for page in reader.pages:
-            parts.append(page.extract_text() or "")
-        return "\n".join(parts)
+        return _pdf_to_text(path, workers)
     elif path.suffix.lower() in {".txt", ".md"}:
-        return path.read_text(encoding="utf-8", errors="ignore")
+        return _read_text(path)
     else:
         raise ValueError(f"Unsupported file type: {path.suffix}")
 
 
+_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=1200,
+    chunk_overlap=150,
+    separators=["\n\n", "\n", " ", ""],
+)
+
+
 def chunk_text(text: str) -> List[str]:
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1200,
-        chunk_overlap=150,
-        separators=["\n\n", "\n", " ", ""],
-    )
-    return splitter.split_text(text)
+    return _SPLITTER.split_text(text)
+
+
+# Chunk IDs embed this hash, so changing the algorithm would re-ingest everything
+_SHA256 = hashlib.sha256(usedforsecurity=False)
 
 
 def hash_text(text: str) -> str:
-    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
-
-
-def build_items(file_path: pathlib.Path, chunks: List[str]) -> List[Tuple[str, str, Dict]]:
-    items: List[Tuple[str, str, Dict]] = []
-    for idx, chunk in enumerate(chunks):
-        cid = f"{file_path.name}-{idx}-{hash_text(chunk)}"
-        items.append(
-            (
-                cid,
-                chunk,
-                {
-                    "source": str(file_path),
-                    "chunk_id": idx,
-                    "text": chunk,
-                },
-            )
+    h = _SHA256.copy()
+    h.update(text.encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def iter_items(
+    path: pathlib.Path,
+    source: Optional[pathlib.Path] = None,
+    workers: int = PDF_WORKERS,
+) -> Iterator[Tuple[str, str, Dict]]:
+    """Yield (id, text, metadata) for each chunk of a file.
+
+    ``source`` is the name recorded for the chunks when ``path`` is only a
+    temporary copy, e.g. an uploaded file.
+    """
+    source = source or path
+    for idx, chunk in enumerate(chunk_text(file_to_text(path, workers))):
+        yield (
+            f"{source.name}-{idx}-{hash_text(chunk)}",
+            chunk,
+            {
+                "source": str(source),
+                "chunk_id": idx,
+            },
         )
-    return items
 
 
-def upsert_items(index_name: str, namespace: str, items: List[Tuple[str, str, Dict]]) -> None:
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+def _bounded_map(
+    executor: Executor,
+    fn: Callable[[T], R],
+    iterable: Iterable[T],
+    limit: int,
+    weight: Optional[Callable[[T], int]] = None,
+    max_weight: int = 0,
+) -> Iterator[R]:
+    """Like ``executor.map`` but with at most ``limit`` calls in flight.
+
+    With ``weight``, the in-flight items' total weight is also kept within
+    ``max_weight`` (a single heavier item still runs on its own).
+
+    The input is consumed lazily, so a slow consumer holds back the producer
+    instead of letting results pile up in memory.
+    """
+    pending: Deque[Tuple["Future[R]", int]] = deque()
+    inflight = 0
+    for item in iterable:
+        w = weight(item) if weight else 0
+        while pending and (len(pending) >= limit or (weight and inflight + w > max_weight)):
+            future, done = pending.popleft()
+            inflight -= done
+            yield future.result()
+        pending.append((executor.submit(fn, item), w))
+        inflight += w
+    while pending:
+        yield pending.popleft()[0].result()
+
+
+def _process_file(path: pathlib.Path) -> List[Tuple[str, str, Dict]]:
+    # Runs in a worker process per file, so don't fan out again across pages
+    return list(iter_items(path, workers=1))
+
+
+def iter_file_items(paths: List[pathlib.Path]) -> Iterator[Tuple[str, str, Dict]]:
+    """Yield items for each file, parsing several files ahead in worker processes."""
+    if len(paths) <= 1:
+        for p in paths:
+            yield from iter_items(p)
+        return
+    # Parse files in parallel; a slow PDF no longer holds up the rest
+    workers = min(os.cpu_count() or 1, len(paths))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for items in _bounded_map(executor, _process_file, paths, 2 * workers):
+            yield from items
+
+
+def _is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, (RateLimitError, APIConnectionError, InternalServerError)):
+        return True
+    if isinstance(exc, PineconeConnectionError):
+        return True
+    if isinstance(exc, PineconeApiException):
+        status = _status(exc) or 0
+        return status == 429 or status >= 500
+    return False
+
+
+def _status(exc: PineconeApiException) -> Optional[int]:
+    # The pinecone 10 rewrite renamed ``status`` to ``status_code``
+    return getattr(exc, "status", None) or getattr(exc, "status_code", None)
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds to wait according to the error's Retry-After header, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or getattr(exc, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+_backoff = wait_exponential_jitter(initial=1, max=MAX_RETRY_WAIT)
+
+
+def _wait(retry_state: RetryCallState) -> float:
+    delay = _retry_after(retry_state.outcome.exception())
+    if delay is None:
+        return _backoff(retry_state)
+    # Upload requests run through here too, so never block on a huge header value
+    return min(max(delay, 0.0), MAX_RETRY_WAIT)
+
+
+# Rate-limit bursts and 5xx errors during long ingests are retried instead of
+# throwing away all the work done so far
+_with_retries = retry(
+    retry=retry_if_exception(_is_transient),
+    wait=_wait,
+    stop=stop_after_attempt(MAX_ATTEMPTS),
+    reraise=True,
+)
+
+
+class RateLimiter:
+    """Thread-safe token buckets for OpenAI's requests- and tokens-per-minute limits.
+
+    Each embeddings request takes one request and its token count up front,
+    blocking until both buckets have refilled enough, so concurrent workers
+    stay under the account's limits instead of bursting into 429s.
+    """
+
+    def __init__(self, rpm: int, tpm: int) -> None:
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int) -> None:
+        # A request larger than the bucket would otherwise wait forever
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                refill = (now - self._updated) / 60
+                self._updated = now
+                self._requests = min(self.rpm, self._requests + refill * self.rpm)
+                self._tokens = min(self.tpm, self._tokens + refill * self.tpm)
+                wait = 60 * max((1 - self._requests) / self.rpm, (tokens - self._tokens) / self.tpm)
+                if wait <= 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+
+@_with_retries
+def _create_embeddings(client: OpenAI, texts: List[str]) -> List[List[float]]:
+    emb = client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts,
+        dimensions=EMBED_DIM or NOT_GIVEN,
+    )
+    return [data.embedding for data in emb.data]
+
+
+@_with_retries
+def _fetch_ids(index, ids: List[str], namespace: str) -> Set[str]:
+    return set(index.fetch(ids=ids, namespace=namespace).vectors.keys())
+
+
+def existing_ids(index, ids: List[str], namespace: str) -> Set[str]:
+    """The subset of ``ids`` already stored in the namespace."""
+    found: Set[str] = set()
+    for i in range(0, len(ids), FETCH_BATCH_SIZE):
+        found.update(_fetch_ids(index, ids[i : i + FETCH_BATCH_SIZE], namespace))
+    return found
+
+
+@_with_retries
+def _upsert(index, vectors: List[Dict], namespace: str) -> None:
+    index.upsert(vectors=vectors, namespace=namespace)
+
+
+# Clients and index handles are reused across upsert_items calls (e.g. one per
+# API upload) so connections and the index check aren't repeated
+@lru_cache(maxsize=1)
+def _openai_client() -> OpenAI:
+    if not os.getenv("OPENAI_API_KEY"):
         raise RuntimeError("OPENAI_API_KEY is not set")
-    client = OpenAI()
-    pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"]) 
-    
+    # Retries are handled by _with_retries, which also covers Pinecone
+    return OpenAI(max_retries=0)
+
+
+@lru_cache(maxsize=1)
+def _pinecone() -> Pinecone:
+    return Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+
+
+@lru_cache(maxsize=None)
+def _index(index_name: str):
+    pc = _pinecone()
     # Create index if it doesn't exist
-    if index_name not in [idx["name"] for idx in pc.list_indexes()]:
+    if index_name not in pc.list_indexes().names():
         print(f"Creating index '{index_name}'...")
         pc.create_index(
             name=index_name,
-            dimension=1536,  # text-embedding-3-small dimension
+            dimension=EMBED_DIM or 1536,  # text-embedding-3-small dimension
             metric="cosine",
             spec=ServerlessSpec(cloud="aws", region=os.environ["PINECONE_ENV"]),
         )
         print(f"Index '{index_name}' created successfully!")
-    
-    index = pc.Index(index_name)
-
-    # embed in small batches
-    batch_size = 64
-    for i in range(0, len(items), batch_size):
-        batch = items[i : i + batch_size]
-        texts = [t for _id, t, _m in batch]
-        emb = client.embeddings.create(model=os.getenv("EMBEDDING_MODEL", "text-embedding-3-small"), input=texts)
+    return pc.Index(index_name, pool_threads=UPSERT_POOL_THREADS)
+
+
+# One limiter per tier, so concurrent uploads share the account's budget
+@lru_cache(maxsize=None)
+def _rate_limiter(tier: str) -> RateLimiter:
+    if tier not in RATE_LIMIT_TIERS:
+        raise ValueError(f"Unknown OpenAI tier {tier!r}; expected one of {', '.join(RATE_LIMIT_TIERS)}")
+    return RateLimiter(*RATE_LIMIT_TIERS[tier])
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def batch_items(
+    items: Iterable[Tuple[str, str, Dict]],
+    max_items: int = MAX_BATCH_ITEMS,
+    max_tokens: int = MAX_BATCH_TOKENS,
+) -> Iterator[Tuple[List[Tuple[str, str, Dict]], int]]:
+    """Group items into embedding requests bounded by item count and token budget.
+
+    Yields each batch with its token count.
+    """
+    encoding = _encoding()
+    batch: List[Tuple[str, str, Dict]] = []
+    tokens = 0
+    for item in items:
+        n = len(encoding.encode_ordinary(item[1]))
+        if batch and (len(batch) >= max_items or tokens + n > max_tokens):
+            yield batch, tokens
+            batch, tokens = [], 0
+        batch.append(item)
+        tokens += n
+    if batch:
+        yield batch, tokens
+
+
+def upsert_items(
+    index_name: str,
+    namespace: str,
+    items: Iterable[Tuple[str, str, Dict]],
+    concurrency: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    force: bool = False,
+    tier: Optional[str] = OPENAI_TIER,
+) -> int:
+    """Embed and upsert items as they arrive; returns the number of items ingested.
+
+    ``tier`` names an entry in RATE_LIMIT_TIERS to throttle embedding requests
+    to; pass None to limit them only by ``concurrency``.
+    """
+    client = _openai_client()
+    index = _index(index_name)
+    limiter = _rate_limiter(tier) if tier else None
+
+    # Fill each embeddings request up to OpenAI's limits unless a batch size is forced
+    max_tokens = min(MAX_BATCH_TOKENS, limiter.tpm) if limiter else MAX_BATCH_TOKENS
+    batches = batch_items(items, max_items=batch_size or MAX_BATCH_ITEMS, max_tokens=max_tokens)
+    concurrency = max(1, concurrency or MAX_EMBED_CONCURRENCY)
+
+    def embed(batch_tokens: Tuple[List[Tuple[str, str, Dict]], int]) -> Tuple[List[Dict], int]:
+        batch, tokens = batch_tokens
+        total = len(batch)
+        if not force:
+            # IDs are content hashes, so a known ID means the chunk is unchanged
+            existing = existing_ids(index, [_id for _id, _t, _m in batch], namespace)
+            batch = [item for item in batch if item[0] not in existing]
+            if not batch:
+                return [], total
+        if limiter:
+            # Counts skipped chunks too, which errs on the safe side
+            limiter.acquire(tokens)
+        embeddings = _create_embeddings(client, [t for _id, t, _m in batch])
         vectors = []
-        for (_id, _t, meta), data in zip(batch, emb.data):
-            vectors.append({"id": _id, "values": data.embedding, "metadata": meta})
-        index.upsert(vectors=vectors, namespace=namespace)
+        for (_id, text, meta), values in zip(batch, embeddings):
+            # The chunk text is only stored in Pinecone metadata (retrieval reads it
+            # from there), not duplicated in the in-memory items
+            values = [round(v, VECTOR_DECIMALS) for v in values]
+            vectors.append({"id": _id, "values": values, "metadata": {**meta, "text": text}})
+        return vectors, total
+
+    # Keep several embedding requests in flight; results come back in order
+    # and their upserts are queued on the index's own thread pool
+    count = 0
+    skipped = 0
+    pending_upserts: Deque[Tuple[object, List[Dict]]] = deque()
+
+    def finish_upsert() -> None:
+        result, vectors = pending_upserts.popleft()
+        try:
+            result.get()
+        except Exception as e:
+            if not _is_transient(e):
+                raise
+            # Resend in the foreground with backoff
+            _upsert(index, vectors, namespace)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = _bounded_map(
+            executor, embed, batches, concurrency, weight=lambda b: b[1], max_weight=MAX_INFLIGHT_TOKENS
+        )
+        for vectors, total in in_flight:
+            for i in range(0, len(vectors), UPSERT_BATCH_SIZE):
+                chunk = vectors[i : i + UPSERT_BATCH_SIZE]
+                pending_upserts.append((index.upsert(vectors=chunk, namespace=namespace, async_req=True), chunk))
+                if len(pending_upserts) >= UPSERT_POOL_THREADS:
+                    finish_upsert()
+            count += total
+            skipped += total - len(vectors)
+    while pending_upserts:
+        finish_upsert()
+    if skipped:
+        print(f"Skipped {skipped} unchanged chunks already in the index.")
+    return count
+
+
+def find_files(root: pathlib.Path) -> List[pathlib.Path]:
+    """Supported files under root, filtered by name in a single directory walk."""
+    paths: List[pathlib.Path] = []
+    for dirpath, _dirnames, filenames in os.walk(root):
+        for name in filenames:
+            # An empty stem means no extension, or a dotfile like ".md"
+            stem, _, ext = name.rpartition(".")
+            if stem and ext.lower() in SUPPORTED_SUFFIXES:
+                paths.append(pathlib.Path(dirpath, name))
+    return paths
+
+
+def file_digest(path: pathlib.Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+
+class IngestedFiles:
+    """Local record of whole files already upserted into an index namespace.
+
+    This is the file-level counterpart of the chunk ID check in upsert_items:
+    an unchanged file is skipped before it is even parsed. Entries are keyed
+    by path as well as content, since chunk IDs and the ``source`` metadata
+    come from the path; a renamed or moved file is ingested again. The
+    embedding model and size are part of the key too, and each entry keeps
+    one of the file's chunk IDs so callers can confirm it is still in the
+    index (which may have been recreated, or belong to another project).
+    """
+
+    def __init__(self, path: pathlib.Path = INGEST_CACHE) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS ingest_cache ("
+            "file_hash TEXT NOT NULL, source TEXT NOT NULL, index_name TEXT NOT NULL, "
+            "namespace TEXT NOT NULL, embedding TEXT NOT NULL, n_chunks INTEGER NOT NULL, chunk_id TEXT, "
+            "PRIMARY KEY (file_hash, source, index_name, namespace, embedding))"
+        )
+
+    @staticmethod
+    def embedding() -> str:
+        return f"{EMBEDDING_MODEL}:{EMBED_DIM or 'full'}"
+
+    def get(self, file_hash: str, source: str, index_name: str, namespace: str) -> Optional[Tuple[int, Optional[str]]]:
+        """(n_chunks, chunk_id) recorded for the file, or None if it wasn't ingested."""
+        return self._db.execute(
+            "SELECT n_chunks, chunk_id FROM ingest_cache "
+            "WHERE file_hash = ? AND source = ? AND index_name = ? AND namespace = ? AND embedding = ?",
+            (file_hash, source, index_name, namespace, self.embedding()),
+        ).fetchone()
+
+    def add(self, files: Iterable[Tuple[str, str, int, Optional[str]]], index_name: str, namespace: str) -> None:
+        """Record (file_hash, source, n_chunks, chunk_id) entries."""
+        embedding = self.embedding()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO ingest_cache "
+                "(file_hash, source, index_name, namespace, embedding, n_chunks, chunk_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (file_hash, source, index_name, namespace, embedding, n_chunks, chunk_id)
+                    for file_hash, source, n_chunks, chunk_id in files
+                ],
+            )
+
+    def forget(self, index_name: str, namespace: str) -> None:
+        with self._db:
+            self._db.execute(
+                "DELETE FROM ingest_cache WHERE index_name = ? AND namespace = ?",
+                (index_name, namespace),
+            )
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def reset_namespace(index_name: str, namespace: str) -> None:
+    """Delete every vector in a namespace and forget which files were ingested into it."""
+    try:
+        _index(index_name).delete(delete_all=True, namespace=namespace)
+    except PineconeApiException as e:
+        # The namespace doesn't exist yet, so there is nothing to delete
+        if _status(e) != 404:
+            raise
+    ingested = IngestedFiles()
+    try:
+        ingested.forget(index_name, namespace)
+    finally:
+        ingested.close()
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Ingest files into Pinecone")
     parser.add_argument("path", type=str, help="File or directory to ingest")
     parser.add_argument("--namespace", type=str, default="default")
-    parser.add_argument("--index", type=str, default=os.getenv("PINECONE_INDEX", "documents"))
+    parser.add_argument("--index", type=str, default=PINECONE_INDEX)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help=f"Concurrent embedding requests (default: up to {MAX_EMBED_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help=f"Chunks per embedding request (default: up to {MAX_BATCH_ITEMS}, bounded by tokens)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-parse files and re-embed chunks even if they were ingested before (bypasses the file cache)",
+    )
+    parser.add_argument(
+        "--reset-namespace",
+        action="store_true",
+        help="Delete all vectors in the namespace before ingesting, e.g. after the chunk IDs changed",
+    )
+    parser.add_argument(
+        "--tier",
+        choices=list(RATE_LIMIT_TIERS),
+        default=OPENAI_TIER,
+        help=f"OpenAI usage tier whose embedding rate limits to stay under (default: {OPENAI_TIER})",
+    )
     args = parser.parse_args()
 
     target = pathlib.Path(args.path)
-    paths: List[pathlib.Path] = []
-    if target.is_dir():
-        for p in target.rglob("*"):
-            if p.suffix.lower() in {".pdf", ".txt", ".md"}:
-                paths.append(p)
-    else:
-        paths.append(target)
+    paths = find_files(target) if target.is_dir() else [target]
+
+    if args.reset_namespace:
+        print(f"Deleting all vectors in index '{args.index}' namespace '{args.namespace}'...")
+        reset_namespace(args.index, args.namespace)
 
-    all_items: List[Tuple[str, str, Dict]] = []
-    for p in paths:
-        text = file_to_text(p)
-        chunks = chunk_text(text)
-        all_items.extend(build_items(p, chunks))
+    # --force re-parses everything, so don't spend a full read of each file hashing it
+    ingested = None if args.force else IngestedFiles()
+    try:
+        items: Iterable[Tuple[str, str, Dict]]
+        if ingested is None:
+            items = iter_file_items(paths)
+        else:
+            digests = {p: file_digest(p) for p in paths}
+            recorded = {p: ingested.get(digests[p], str(p), args.index, args.namespace) for p in paths}
+            # Trust the cache only if the index still holds the files' chunks
+            present = existing_ids(
+                _index(args.index),
+                [entry[1] for entry in recorded.values() if entry and entry[1]],
+                args.namespace,
+            )
+            paths = [
+                p for p in paths
+                if recorded[p] is None or (recorded[p][1] is not None and recorded[p][1] not in present)
+            ]
+            skipped = len(digests) - len(paths)
+            if skipped:
+                print(f"Skipped {skipped} unchanged files already ingested.")
+            if not paths:
+                return
 
-    if not all_items:
+            chunk_counts = dict.fromkeys(map(str, paths), 0)
+            first_ids: Dict[str, str] = {}
+
+            def counted(items: Iterable[Tuple[str, str, Dict]]) -> Iterator[Tuple[str, str, Dict]]:
+                for item in items:
+                    source = item[2]["source"]
+                    chunk_counts[source] += 1
+                    first_ids.setdefault(source, item[0])
+                    yield item
+
+            items = counted(iter_file_items(paths))
+
+        # Chunks stream from the parsers into embedding and upsert, so memory use
+        # doesn't grow with the size of the corpus
+        count = upsert_items(
+            index_name=args.index,
+            namespace=args.namespace,
+            items=items,
+            concurrency=args.concurrency,
+            batch_size=args.batch_size,
+            force=args.force,
+            tier=args.tier,
+        )
+        if ingested is not None:
+            # Only recorded once everything is upserted, so a failed run is retried in full
+            ingested.add(
+                ((digests[p], str(p), chunk_counts[str(p)], first_ids.get(str(p))) for p in paths),
+                args.index,
+                args.namespace,
+            )
+    finally:
+        if ingested is not None:
+            ingested.close()
+    if not count:
         print("No content found.")
         return
-
-    upsert_items(index_name=args.index, namespace=args.namespace, items=all_items)
-    print(f"Ingested {len(all_items)} chunks into index '{args.index}' namespace '{args.namespace}'.")
+    print(f"Ingested {count} chunks into index '{args.index}' namespace '{args.namespace}'.")
 
 
 if __name__ == "__main__":